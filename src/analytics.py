@@ -3,74 +3,273 @@
 MapReduce Log Analytics
 Analyzes proxy access logs using MapReduce pattern
 
-Input: access.log
+Input: access.log (or access.bin with LOG_FORMAT=binary)
 Output: Statistics about domain access, cache hits, response times
 """
 
+import csv
 import os
+import pickle
 import sys
-from collections import defaultdict
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import accumulate, repeat
+from math import expm1, isfinite, log1p
+from operator import floordiv, itemgetter, methodcaller, mul
 from datetime import datetime
 
+from logger_server import LOG_FILE_NAMES, RECORD, is_binary_log, load_strings, strings_file_of
+
 LOG_DIR = os.environ.get('LOG_DIR', './logs')
-LOG_FILE = os.path.join(LOG_DIR, 'access.log')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'text' or 'binary' (see logger_server.py)
+LOG_FILE = os.path.join(LOG_DIR, LOG_FILE_NAMES[LOG_FORMAT])
+
+# Parallel MAP: one chunk of lines per process
+MAP_WORKERS = int(os.environ.get('MAP_WORKERS', os.cpu_count() or 1))
+MIN_PARALLEL_LINES = 50000  # below this, process startup costs more than it saves
+
+# Log is streamed in large reads so memory stays flat regardless of log size
+READ_CHUNK_SIZE = 128 << 20  # 128 MB
+
+# Checkpoint next to the log: byte offset processed so far + results up to it
+STATE_FILE_NAME = '.analytics_state.pkl'
+
+# Field extractors (C-level, no Python frame per line)
+split_fields = methodcaller('split', '|', 8)
+hour_of = itemgetter(slice(0, 13))  # YYYY-MM-DDTHH
+
+# Binary timestamps are bucketed by quarter hour (every UTC offset is a
+# multiple of it) and only each distinct bucket is formatted as a local hour
+HOUR_BUCKET = 900
+
+# Count categories in the results (each is a Counter of value -> count)
+CATEGORIES = ('domain', 'cache', 'worker', 'status', 'hour')
+
+# Response time percentiles shown in the report
+PERCENTILES = (50, 95, 99)
+
+# Response times are kept as a histogram of log-scale buckets, so results
+# (and the checkpoint) stay small however many requests were counted:
+# bucket = int(log1p(ms) * RT_BUCKET_SCALE), each ~0.5% wide
+RT_BUCKET_SCALE = 200
+
+def empty_results():
+    """
+    Results/partial layout: one Counter per category, response time
+    scalars, and a Counter of response time buckets (see rt_buckets)
+    """
+    results = {category: Counter() for category in CATEGORIES}
+    results['rt_sum'] = 0.0
+    results['rt_n'] = 0
+    results['rt_hist'] = Counter()
+    return results
+
+def rt_buckets(response_times):
+    """Histogram of response times (bucket -> count)"""
+    return Counter(map(int, map(mul, map(log1p, response_times), repeat(RT_BUCKET_SCALE))))
+
+def percentiles(hist, ps):
+    """
+    Linear-interpolated percentiles (numpy's default method) from a
+    response time histogram, each value being its bucket's midpoint
+    """
+    buckets = sorted(hist)
+    cumulative = list(accumulate(hist[b] for b in buckets))
+    last = cumulative[-1] - 1
+    
+    def value_at(rank):
+        return expm1((buckets[bisect_right(cumulative, rank)] + 0.5) / RT_BUCKET_SCALE)
+    
+    out = {}
+    for p in ps:
+        pos = last * p / 100
+        lo = int(pos)
+        hi = min(lo + 1, last)
+        out[p] = value_at(lo) + (value_at(hi) - value_at(lo)) * (pos - lo)
+    return out
 
-def mapper(line):
+def mapper(lines):
     """
-    MAP phase: Parse log line and emit (key, value) pairs
+    MAP phase: Parse a batch of log lines column-wise and count each category
     Input: "timestamp|client_ip|method|url|domain|status|worker|cached|response_time"
-    Output: List of (key, value) tuples
+    Output: partial results, see empty_results()
+
+    The whole batch is split with str.split (stopping after the 8th '|'),
+    and each column is pulled out with itemgetter and counted by Counter,
+    so the per-line work runs in C builtins. Counts are combined per key
+    (a combiner) before they leave the mapper.
+    Blank lines are dropped before splitting.
     """
+    rows = [r for r in map(split_fields, filter(None, lines)) if len(r) == 9]
+    
     try:
-        parts = line.strip().split('|')
-        if len(parts) < 9:
-            return []
-        
-        timestamp, client_ip, method, url, domain, status, worker, cached, response_time = parts
-        
-        # Emit multiple key-value pairs for different analyses
-        results = [
-            # For domain count
-            (('domain', domain), 1),
-            # For cache hit rate
-            (('cache', cached), 1),
-            # For worker distribution
-            (('worker', worker), 1),
-            # For status code distribution
-            (('status', status), 1),
-            # For response time sum (to calculate average)
-            (('response_time', 'total'), float(response_time)),
-            (('response_time', 'count'), 1),
-            # For hourly distribution
-            (('hour', timestamp[:13]), 1),  # YYYY-MM-DDTHH
-        ]
-        
-        return results
-        
-    except Exception as e:
-        return []
+        response_times = list(map(float, map(itemgetter(8), rows)))
+    except ValueError:
+        response_times = None
+    if response_times is None or not _all_valid(response_times):
+        # Malformed, negative or non-finite response time somewhere in the batch: drop those lines
+        return mapper('|'.join(r) for r in rows if _is_response_time(r[8]))
+    
+    return {
+        'domain': Counter(map(itemgetter(4), rows)),                # For domain count
+        'cache': Counter(map(itemgetter(7), rows)),                 # For cache hit rate
+        'worker': Counter(map(itemgetter(6), rows)),                # For worker distribution
+        'status': Counter(map(itemgetter(5), rows)),                # For status code distribution
+        'hour': Counter(map(hour_of, map(itemgetter(0), rows))),    # For hourly distribution
+        # Response time: sum/count for the average, histogram for percentiles
+        'rt_sum': sum(response_times),
+        'rt_n': len(rows),
+        'rt_hist': rt_buckets(response_times),
+    }
+
+def binary_mapper(buf, names):
+    """
+    MAP phase for the binary log: unpack a batch of fixed-size RECORDs
+    Output: partial results, see empty_results()
+
+    Records are unpacked by struct.iter_unpack and transposed into columns,
+    so nothing is split or parsed. Columns are counted on their raw ids and
+    ints, and only the distinct values are turned into the text log's keys.
+    """
+    if not buf:
+        return empty_results()
+    timestamp, _, status, domain, worker, cached, response_times = zip(*RECORD.iter_unpack(buf))
+    if not _all_valid(response_times):
+        # Negative or non-finite response time somewhere in the batch: drop those records
+        records = [r for r in RECORD.iter_unpack(buf) if _is_response_time(r[6])]
+        if not records:
+            return empty_results()
+        timestamp, _, status, domain, worker, cached, response_times = zip(*records)
+    
+    return {
+        'domain': _relabel(Counter(domain), names.__getitem__),
+        'cache': _relabel(Counter(cached), lambda c: str(bool(c))),
+        'worker': _relabel(Counter(worker), names.__getitem__),
+        'status': _relabel(Counter(status), str),
+        'hour': _relabel(Counter(map(floordiv, timestamp, repeat(HOUR_BUCKET))),
+                         lambda b: datetime.fromtimestamp(b * HOUR_BUCKET).strftime('%Y-%m-%dT%H')),
+        'rt_sum': sum(response_times),
+        'rt_n': len(response_times),
+        'rt_hist': rt_buckets(response_times),
+    }
+
+def _relabel(counts, label):
+    """Re-key a Counter by label(key), summing keys that end up equal"""
+    out = Counter()
+    for key, count in counts.items():
+        out[label(key)] += count
+    return out
+
+def reducer(partials):
+    """
+    REDUCE phase: Merge combined partial results from each mapper
+    """
+    results = empty_results()
+    for partial in partials:
+        for category in CATEGORIES:
+            results[category].update(partial[category])
+        results['rt_sum'] += partial['rt_sum']
+        results['rt_n'] += partial['rt_n']
+        results['rt_hist'].update(partial['rt_hist'])
+    return results
 
-def reducer(key, values):
+def split_chunks(lines, n):
+    """Split lines into n contiguous chunks of roughly equal size"""
+    size = -(-len(lines) // n)
+    return [lines[i:i + size] for i in range(0, len(lines), size)]
+
+def iter_log_lines(f, chunk_size=READ_CHUNK_SIZE):
     """
-    REDUCE phase: Aggregate values for each key
+    Stream complete lines from a binary file, one large read() per batch
+    Yields (lines, offset), offset being the file position just past the
+    batch's last newline. The partial line at the end of each read is
+    carried over to the next one; a partial line at EOF (still being
+    written) is left for the next run.
     """
-    if key[0] == 'response_time' and key[1] == 'total':
-        return sum(values)  # Sum for average calculation
-    else:
-        return sum(values)  # Count
+    tail = b''
+    offset = f.tell()
+    while True:
+        buf = f.read(chunk_size)
+        if not buf:
+            break
+        end = buf.rfind(b'\n')
+        if end < 0:
+            tail += buf
+            continue
+        lines = (tail + buf[:end]).decode('utf-8', 'replace').split('\n')
+        offset += len(tail) + end + 1
+        tail = buf[end + 1:]
+        yield lines, offset
 
-def shuffle(mapped_data):
+def iter_records(f, end, chunk_size=READ_CHUNK_SIZE):
     """
-    SHUFFLE phase: Group values by key
+    Stream whole RECORDs from a binary log up to byte end
+    Yields (buf, offset) like iter_log_lines; a partially written record
+    at the end is left for the next run.
     """
-    grouped = defaultdict(list)
-    for key, value in mapped_data:
-        grouped[key].append(value)
-    return grouped
+    chunk_size -= chunk_size % RECORD.size
+    offset = f.tell()
+    end -= (end - offset) % RECORD.size
+    while offset < end:
+        buf = f.read(min(chunk_size, end - offset))
+        if not buf:
+            break
+        offset += len(buf)
+        yield buf, offset
+
+def load_state(state_file, log_file, log_stat):
+    """
+    Load the checkpoint for log_file, or None if there is none, the log
+    was rotated/truncated since (different inode, or shorter than offset)
+    or the results layout changed
+    """
+    try:
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    
+    if (state.get('log_file') != os.path.abspath(log_file)
+            or state.get('inode') != log_stat.st_ino
+            or state.get('offset', 0) > log_stat.st_size):
+        print("[MapReduce] Checkpoint is for another log or the log was rotated, starting over")
+        return None
+    if state.get('results', {}).keys() != empty_results().keys():
+        print("[MapReduce] Checkpoint is from an older version, starting over")
+        return None
+    return state
 
-def run_mapreduce(log_file):
+def save_state(state_file, log_file, log_stat, offset, results):
+    """Write the checkpoint atomically (temp file + rename)"""
+    state = {
+        'log_file': os.path.abspath(log_file),
+        'inode': log_stat.st_ino,
+        'offset': offset,
+        'results': {key: results[key] for key in empty_results()},
+    }
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, state_file)
+
+def _all_valid(response_times):
+    """Whether every response time is finite and >= 0 (one sum and one min, in C)"""
+    return not response_times or (isfinite(sum(response_times)) and min(response_times) >= 0)
+
+def _is_response_time(value):
+    """Whether value is a usable response time: a finite, non-negative float"""
+    try:
+        value = float(value)
+    except ValueError:
+        return False
+    return isfinite(value) and value >= 0
+
+def run_mapreduce(log_file, incremental=True):
     """
     Execute MapReduce pipeline
+    With incremental=True, only the part of the log appended since the
+    last run is processed and merged into the checkpointed results.
     """
     print("=" * 60)
     print("[MapReduce] Starting Log Analysis")
@@ -82,30 +281,75 @@ def run_mapreduce(log_file):
         print("[MapReduce] Run some proxy requests first to generate logs.")
         return None
     
-    # Read log file
-    with open(log_file, 'r') as f:
-        lines = f.readlines()
-    
-    print(f"[MapReduce] Processing {len(lines)} log entries...")
+    state_file = os.path.join(os.path.dirname(log_file), STATE_FILE_NAME)
     
     # ========== MAP PHASE ==========
-    print("\n[MAP] Parsing log entries...")
-    mapped_data = []
-    for line in lines:
-        mapped_data.extend(mapper(line))
-    print(f"[MAP] Generated {len(mapped_data)} key-value pairs")
-    
-    # ========== SHUFFLE PHASE ==========
-    print("\n[SHUFFLE] Grouping by keys...")
-    shuffled = shuffle(mapped_data)
-    print(f"[SHUFFLE] Created {len(shuffled)} groups")
+    # Each chunk is counted by its own mapper, which combines values per key
+    # before returning, so there is no separate SHUFFLE of per-line pairs.
+    partials = []
+    tail_lines = []
+    n_lines = 0
+    executor = None
+    try:
+        with open(log_file, 'rb') as f:
+            log_stat = os.fstat(f.fileno())
+            state = load_state(state_file, log_file, log_stat) if incremental else None
+            offset = 0
+            if state is not None:
+                offset = state['offset']
+                partials.append(state['results'])
+                print(f"[MapReduce] Resuming at byte {offset} ({state['results']['rt_n']} entries already counted)")
+            f.seek(offset)
+            print(f"[MapReduce] Streaming {log_stat.st_size - offset} bytes...")
+            
+            if is_binary_log(log_file):
+                # Names are appended before any record using them, so the table
+                # read now covers every record up to the current size
+                names = load_strings(strings_file_of(log_file))
+                print("\n[MAP] Unpacking binary records...")
+                for buf, offset in iter_records(f, log_stat.st_size):
+                    n_lines += len(buf) // RECORD.size
+                    partials.append(binary_mapper(buf, names))
+            else:
+                print(f"\n[MAP] Parsing log entries on up to {MAP_WORKERS} process(es)...")
+                for lines, offset in iter_log_lines(f):
+                    n_lines += len(lines)
+                    if MAP_WORKERS > 1 and len(lines) >= MIN_PARALLEL_LINES:
+                        if executor is None:
+                            executor = ProcessPoolExecutor(max_workers=MAP_WORKERS)
+                        futures = [executor.submit(mapper, chunk) for chunk in split_chunks(lines, MAP_WORKERS)]
+                        partials.append(reducer(future.result() for future in as_completed(futures)))
+                    else:
+                        partials.append(mapper(lines))
+                if not incremental:
+                    # A last line without a newline is still counted by a full
+                    # run, but kept out of the checkpoint (it may be incomplete)
+                    f.seek(offset)
+                    tail = f.read()
+                    if tail:
+                        tail_lines = tail.decode('utf-8', 'replace').split('\n')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print(f"[MAP] Processed {n_lines + len(tail_lines)} log entries")
     
     # ========== REDUCE PHASE ==========
-    print("\n[REDUCE] Aggregating values...")
-    results = {}
-    for key, values in shuffled.items():
-        results[key] = reducer(key, values)
+    print("\n[REDUCE] Merging partial results...")
+    results = reducer(partials)
+    print(f"[REDUCE] Aggregated {sum(len(results[c]) for c in CATEGORIES)} keys")
     
+    try:
+        save_state(state_file, log_file, log_stat, offset, results)
+    except OSError as e:
+        print(f"[MapReduce] Could not save checkpoint: {e}")
+    if tail_lines:
+        results = reducer([results, mapper(tail_lines)])
+    
+    if not results['rt_n']:
+        print("[MapReduce] No valid log entries found.")
+        return None
+    
+    results['rt_percentiles'] = percentiles(results['rt_hist'], PERCENTILES)
     return results
 
 def print_report(results):
@@ -122,18 +366,15 @@ def print_report(results):
     # ========== TOP DOMAINS ==========
     print("\n📊 TOP 10 DOMAINS (Most Accessed):")
     print("-" * 40)
-    domains = [(k[1], v) for k, v in results.items() if k[0] == 'domain']
-    domains.sort(key=lambda x: x[1], reverse=True)
-    
-    for i, (domain, count) in enumerate(domains[:10], 1):
+    for i, (domain, count) in enumerate(results['domain'].most_common(10), 1):
         bar = '█' * min(count * 2, 30)
         print(f"  {i:2}. {domain:30} {count:5} {bar}")
     
     # ========== CACHE STATISTICS ==========
     print("\n📦 CACHE STATISTICS:")
     print("-" * 40)
-    cache_hits = results.get(('cache', 'True'), 0)
-    cache_misses = results.get(('cache', 'False'), 0)
+    cache_hits = results['cache'].get('True', 0)
+    cache_misses = results['cache'].get('False', 0)
     total = cache_hits + cache_misses
     
     if total > 0:
@@ -150,30 +391,25 @@ def print_report(results):
     # ========== WORKER DISTRIBUTION ==========
     print("\n⚙️ WORKER DISTRIBUTION (Load Balancing):")
     print("-" * 40)
-    workers = [(k[1], v) for k, v in results.items() if k[0] == 'worker']
-    workers.sort(key=lambda x: x[1], reverse=True)
-    
-    for worker, count in workers:
+    for worker, count in results['worker'].most_common():
         bar = '█' * min(count * 2, 30)
         print(f"  {worker:35} {count:5} {bar}")
     
     # ========== RESPONSE TIME ==========
     print("\n⏱️ RESPONSE TIME:")
     print("-" * 40)
-    total_time = results.get(('response_time', 'total'), 0)
-    count = results.get(('response_time', 'count'), 1)
-    avg_time = total_time / count if count > 0 else 0
+    count = results['rt_n']
+    avg_time = results['rt_sum'] / count if count > 0 else 0
     
     print(f"  Average Response Time: {avg_time:.2f} ms")
+    for p, value in results['rt_percentiles'].items():
+        print(f"  p{p} Response Time:     {value:.2f} ms")
     print(f"  Total Requests:        {count}")
     
     # ========== STATUS CODES ==========
     print("\n📈 HTTP STATUS CODES:")
     print("-" * 40)
-    statuses = [(k[1], v) for k, v in results.items() if k[0] == 'status']
-    statuses.sort(key=lambda x: x[0])
-    
-    for status, count in statuses:
+    for status, count in sorted(results['status'].items()):
         emoji = '✅' if status.startswith('2') else '⚠️' if status.startswith('3') else '❌'
         print(f"  {emoji} {status}: {count}")
     
@@ -181,25 +417,27 @@ def print_report(results):
 
 def export_csv(results, output_file='analytics_report.csv'):
     """Export results to CSV"""
-    import csv
-    
     with open(output_file, 'w', newline='') as f:
         writer = csv.writer(f)
         writer.writerow(['Category', 'Key', 'Value'])
         
-        for (category, key), value in sorted(results.items()):
-            writer.writerow([category, key, value])
+        rows = [(category, key, value) for category in CATEGORIES for key, value in results[category].items()]
+        rows.append(('response_time', 'total', results['rt_sum']))
+        rows.append(('response_time', 'count', results['rt_n']))
+        rows.extend(('response_time', f'p{p}', round(value, 2)) for p, value in results['rt_percentiles'].items())
+        writer.writerows(sorted(rows))
     
     print(f"[MapReduce] Report exported to: {output_file}")
 
 if __name__ == "__main__":
-    # Allow custom log file path
-    log_file = sys.argv[1] if len(sys.argv) > 1 else LOG_FILE
+    # Allow custom log file path; --full ignores the checkpoint and rescans
+    args = [arg for arg in sys.argv[1:] if arg != '--full']
+    log_file = args[0] if args else LOG_FILE
     
     print(f"[MapReduce] Log file: {log_file}")
     
     # Run MapReduce
-    results = run_mapreduce(log_file)
+    results = run_mapreduce(log_file, incremental='--full' not in sys.argv)
     
     # Print report
     if results:
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Access Log Server
+Receives access log lines from the proxy over a Unix datagram socket
+and appends them to access.log for MapReduce analysis
+
+- Proxy side: one non-blocking send() per request, no disk I/O
+- Logger side: group commit, one write per batch of lines
+- LOG_FORMAT=binary: fixed-size records in access.bin instead of text lines
+"""
+
+from contextlib import contextmanager
+import fcntl
+import socket
+import struct
+import threading
+import queue
+import signal
+import time
+import os
+import sys
+
+LOG_DIR = os.environ.get('LOG_DIR', './logs')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'text' or 'binary'
+LOG_FILE_NAMES = {'text': 'access.log', 'binary': 'access.bin'}
+LOG_FILE = os.path.join(LOG_DIR, LOG_FILE_NAMES[LOG_FORMAT])
+LOG_SOCKET = os.environ.get('LOG_SOCKET', '/tmp/proxy.sock')
+
+# Group commit: log lines are batched and written with one syscall
+LOG_FLUSH_BYTES = 64 * 1024   # flush when this many bytes are pending
+LOG_FLUSH_INTERVAL = 0.1      # or when the oldest pending line is this old (seconds)
+
+MAX_DATAGRAM = 256 * 1024
+
+# Binary log: one fixed-size record per request. Domain and worker names are
+# interned in a side table (<log>.strings, one name per line, id = line number)
+# timestamp (s), client ip, status, domain id, worker id, cached, response_time_ms
+RECORD = struct.Struct('<qIHIIBf')
+# What the proxy sends: the same fields with the names appended as "domain\nworker"
+ENTRY = struct.Struct('<qIHBf')
+
+def is_binary_log(log_file):
+    return log_file.endswith('.bin')
+
+def strings_file_of(log_file):
+    return os.path.splitext(log_file)[0] + '.strings'
+
+def load_strings(strings_file):
+    """Names of the side table, indexed by id"""
+    try:
+        with open(strings_file, 'rb') as f:
+            return f.read().decode('utf-8', 'replace').split('\n')[:-1]
+    except FileNotFoundError:
+        return []
+
+def pack_entry(timestamp, client_ip, status, domain, worker, cached, response_time):
+    """Encode one access for a binary log (proxy side)"""
+    try:
+        ip = int.from_bytes(socket.inet_aton(client_ip), 'big')
+    except OSError:
+        ip = 0
+    return ENTRY.pack(int(timestamp), ip, status, cached, response_time) + f"{domain}\n{worker}".encode()
+
+class RecordEncoder:
+    """
+    Turns proxy entries into RECORDs, interning names in the side table
+    A new name is appended to the table before any record refers to it.
+    The log server and the proxy's in-process fallback may both encode
+    into one table, so new ids are assigned under an flock on the table,
+    after reading the names the other writer appended since.
+    """
+    def __init__(self, log_file):
+        self.ids = {}
+        self.n_names = 0
+        self.pos = 0  # bytes of the table read so far
+        self.fd = os.open(strings_file_of(log_file), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        with self.locked():
+            self.read_new_names()
+
+    @contextmanager
+    def locked(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def read_new_names(self):
+        """Pick up names appended to the table since the last read (lock held)"""
+        data = os.pread(self.fd, os.fstat(self.fd).st_size - self.pos, self.pos)
+        self.pos += len(data)
+        for name in data.split(b'\n')[:-1]:
+            self.ids.setdefault(name, self.n_names)
+            self.n_names += 1
+
+    def intern(self, name):
+        name_id = self.ids.get(name)
+        if name_id is None:
+            with self.locked():
+                self.read_new_names()
+                name_id = self.ids.get(name)
+                if name_id is None:
+                    line = name + b'\n'
+                    os.write(self.fd, line)
+                    name_id = self.ids[name] = self.n_names
+                    self.n_names += 1
+                    self.pos += len(line)
+        return name_id
+
+    def __call__(self, entry):
+        timestamp, ip, status, cached, response_time = ENTRY.unpack_from(entry)
+        domain, _, worker = entry[ENTRY.size:].partition(b'\n')
+        return RECORD.pack(timestamp, ip, status, self.intern(domain), self.intern(worker), cached, response_time)
+
+    def close(self):
+        os.close(self.fd)
+
+def append_only_writer(log_queue, log_file):
+    """
+    Group-commit queued log lines (run in a background thread)
+    Lines arriving within LOG_FLUSH_INTERVAL (or up to LOG_FLUSH_BYTES)
+    are joined and appended with a single write on a long-lived fd.
+    A None entry flushes what is pending and stops the writer.
+    For a binary log (.bin) each entry is encoded into a RECORD first.
+    """
+    encode = RecordEncoder(log_file) if is_binary_log(log_file) else None
+    fd = os.open(log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    running = True
+    while running:
+        batch = []
+        size = 0
+        deadline = None
+        while size < LOG_FLUSH_BYTES:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                entry = log_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is None:  # shutdown: flush what we have and stop
+                running = False
+                break
+            if encode is not None:
+                try:
+                    entry = encode(entry)
+                except (struct.error, OSError) as e:
+                    print(f"[Logger] Dropping bad entry: {e}")
+                    continue
+            if deadline is None:
+                deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            batch.append(entry)
+            size += len(entry)
+
+        try:
+            buf = memoryview(b''.join(batch))
+            while buf:
+                buf = buf[os.write(fd, buf):]
+        except OSError as e:
+            print(f"[Logger] Write error: {e}")
+    os.close(fd)
+    if encode is not None:
+        encode.close()
+
+if __name__ == "__main__":
+    socket_path = sys.argv[1] if len(sys.argv) > 1 else LOG_SOCKET
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    # Remove stale socket from a previous run
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(socket_path)
+
+    log_queue = queue.SimpleQueue()
+    writer = threading.Thread(target=append_only_writer, args=(log_queue, LOG_FILE), daemon=True)
+    writer.start()
+
+    # docker stop / restart sends SIGTERM: shut down like Ctrl+C so pending lines are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print(f"[Logger] Listening on {socket_path}")
+    print(f"[Logger] Log File: {LOG_FILE}")
+
+    try:
+        while True:
+            log_queue.put(sock.recv(MAX_DATAGRAM))
+    except KeyboardInterrupt:
+        print("\n[Logger] Shutting down...")
+    finally:
+        log_queue.put(None)
+        writer.join(timeout=1)
+        sock.close()
+        os.remove(socket_path)
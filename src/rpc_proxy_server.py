@@ -9,21 +9,57 @@ HTTP Proxy Server using RPC
 """
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from collections import deque
+from functools import lru_cache
+from urllib.parse import urlsplit, urlparse
 import xmlrpc.client
+import http.client
+import itertools
 import threading
+import json
 import datetime
+import errno
+import socket
+import queue
+import time
 import os
 import sys
 
+from logger_server import LOG_FILE_NAMES, append_only_writer, pack_entry
+
 # ============================================
 # CONFIGURATION
 # ============================================
 # List of RPC workers (scalability)
 WORKERS = os.environ.get('WORKERS', 'http://localhost:8001,http://localhost:8002,http://localhost:8003').split(',')
 
+# Request handler threads (bounded pool instead of a thread per request)
+PROXY_THREADS = int(os.environ.get('PROXY_THREADS', 128))
+
+# Load balancing policy: 'round_robin' or 'least_conn' (fewest requests in flight)
+LB_POLICY = os.environ.get('LB_POLICY', 'round_robin')
+
+# Worker endpoint that returns page content as raw bytes (see rpc_worker.py)
+FETCH_PATH = '/fetch'
+
+# Longest a worker may take to answer a fetch, so a hung worker can't hold a
+# handler thread forever. Covers the worker's worst case: ORIGIN_TIMEOUT (10 s)
+# for the request and each of up to MAX_REDIRECTS (10) redirects.
+WORKER_TIMEOUT = 120  # seconds
+
 # Log directory for MapReduce
 LOG_DIR = os.environ.get('LOG_DIR', './logs')
-LOG_FILE = os.path.join(LOG_DIR, 'access.log')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'text' or 'binary' (see logger_server.py)
+LOG_FILE = os.path.join(LOG_DIR, LOG_FILE_NAMES[LOG_FORMAT])
+
+# Log server socket (falls back to writing LOG_FILE in-process if unreachable)
+LOG_SOCKET = os.environ.get('LOG_SOCKET', '/tmp/proxy.sock')
+LOG_RECONNECT_INTERVAL = 1.0  # seconds between reconnect attempts while it is gone
+
+# send() errors meaning the log server is gone (restarted or stopped), not just busy
+LOG_SERVER_GONE = (errno.ECONNREFUSED, errno.ENOTCONN, errno.ENOENT)
 
 # Ensure log directory exists
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -31,23 +67,121 @@ os.makedirs(LOG_DIR, exist_ok=True)
 # Track active workers
 active_workers = []
 worker_lock = threading.Lock()
-log_lock = threading.Lock()
+log_queue = queue.SimpleQueue()
+log_sock = None
+log_sock_lock = threading.Lock()  # only taken to drop or re-open log_sock
+log_reconnect_at = 0.0
 
 class LoadBalancer:
-    """Simple round-robin load balancer"""
-    def __init__(self):
-        self.index = 0
-        self.lock = threading.Lock()
+    """
+    Round-robin or least-connections load balancer, with no lock per request
+    next() on an itertools.count is atomic under the GIL, and in-flight
+    requests are tracked as list append/pop (also atomic), so len() of a
+    worker's list is its exact in-flight count.
+    """
+    def __init__(self, policy='round_robin'):
+        self.policy = policy
+        self.counter = itertools.count()
+        self.inflight = {}  # worker_url -> one entry per request in flight
     
     def get_worker(self):
-        with self.lock:
-            if not active_workers:
-                return None
-            worker = active_workers[self.index % len(active_workers)]
-            self.index += 1
-            return worker
+        workers = active_workers  # check_workers replaces the list, never mutates it
+        if not workers:
+            return None
+        start = next(self.counter) % len(workers)
+        if self.policy == 'least_conn':
+            # Scan from the round-robin position so ties still rotate
+            return min(workers[start:] + workers[:start],
+                       key=lambda worker: len(self.inflight.get(worker, ())))
+        return workers[start]
+    
+    @contextmanager
+    def track(self, worker_url):
+        """Count a request as in flight on worker_url while the block runs"""
+        inflight = self.inflight.setdefault(worker_url, [])
+        inflight.append(None)
+        try:
+            yield
+        finally:
+            inflight.pop()
+
+load_balancer = LoadBalancer(LB_POLICY)
 
-load_balancer = LoadBalancer()
+class WorkerPool:
+    """
+    Idle connections per worker, reused across requests
+    Each connection stays open (HTTP/1.1 keep-alive), so a request only
+    pays the TCP handshake when the pool is empty. Connections are not
+    thread-safe, so one is checked out per request.
+    """
+    def __init__(self, connect, close):
+        self.connect = connect
+        self.close = close
+        self.idle = {}
+    
+    @contextmanager
+    def connection(self, worker_url):
+        idle = self.idle.setdefault(worker_url, deque())
+        try:
+            conn = idle.pop()
+        except IndexError:
+            conn = self.connect(worker_url)
+        try:
+            yield conn
+        except Exception:
+            self.close(conn)  # connection state unknown, don't reuse it
+            raise
+        idle.append(conn)
+    
+    def discard(self, worker_url):
+        """Close every idle connection to worker_url (they may all be stale)"""
+        idle = self.idle.get(worker_url, ())
+        while idle:
+            try:
+                conn = idle.pop()
+            except IndexError:
+                break
+            self.close(conn)
+
+# XML-RPC control calls (health_check, ...) and raw page fetches
+rpc_pool = WorkerPool(xmlrpc.client.ServerProxy, lambda proxy: proxy('close')())
+fetch_pool = WorkerPool(
+    lambda url: http.client.HTTPConnection(urlsplit(url).netloc, timeout=WORKER_TIMEOUT),
+    lambda conn: conn.close())
+
+def fetch_via_worker(worker_url, url):
+    """
+    Fetch URL through a worker's raw fetch endpoint
+    Like the fetch_url RPC result, but content arrives as raw bytes
+    instead of base64 inside XML, and headers as a pre-serialized
+    header block ('header_block') ready to forward to the client.
+    """
+    for attempt in (0, 1):
+        try:
+            with fetch_pool.connection(worker_url) as conn:
+                conn.request('POST', FETCH_PATH, body=url.encode(),
+                             headers={'Content-Type': 'text/plain; charset=utf-8'})
+                response = conn.getresponse()
+                header_block = response.read(int(response.getheader('X-Header-Length', 0)))
+                content = response.read()
+            break
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # Pooled connection was closed by the worker while idle. The others
+            # idled just as long, so drop them all and retry on a new connection
+            if attempt:
+                raise
+            fetch_pool.discard(worker_url)
+        except socket.timeout:
+            # The connection was closed by the pool (not reused); fail this request
+            raise RuntimeError(f"worker did not answer within {WORKER_TIMEOUT}s") from None
+    
+    if response.status != 200:
+        raise RuntimeError(f"worker returned HTTP {response.status}")
+    
+    result = json.loads(response.getheader('X-Fetch-Meta'))
+    result['header_block'] = header_block
+    result['content'] = content
+    return result
 
 def check_workers():
     """Check which workers are alive"""
@@ -59,8 +193,8 @@ def check_workers():
         if not worker_url:
             continue
         try:
-            proxy = xmlrpc.client.ServerProxy(worker_url)
-            result = proxy.health_check()
+            with rpc_pool.connection(worker_url) as proxy:
+                result = proxy.health_check()
             if result['status'] == 'ok':
                 alive.append(worker_url)
                 print(f"[Proxy] Worker OK: {worker_url} (Cache: {result.get('cache_entries', 0)} entries)")
@@ -72,24 +206,80 @@ def check_workers():
     
     return len(alive)
 
+def connect_log_socket():
+    """Connect to the log server; returns True if log lines go over the socket"""
+    global log_sock
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        sock.connect(LOG_SOCKET)
+        log_sock = sock
+        return True
+    except OSError:
+        sock.close()
+        log_sock = None
+        return False
+
+def send_log(data):
+    """
+    Send one log entry to the log server; returns False if the caller
+    should write it in-process instead. If the server went away (e.g. it
+    was restarted), the socket is reconnected at most once per
+    LOG_RECONNECT_INTERVAL, and each switch is printed once.
+    """
+    global log_sock, log_reconnect_at
+    sock = log_sock
+    if sock is not None:
+        try:
+            sock.send(data)
+            return True
+        except OSError as e:
+            if e.errno not in LOG_SERVER_GONE:
+                return False  # busy (EAGAIN): only this entry goes in-process
+            with log_sock_lock:
+                if log_sock is sock:
+                    log_sock = None
+                    sock.close()
+                    print(f"[Proxy] Log Server lost ({e.strerror}), writing log in-process")
+    
+    if time.monotonic() < log_reconnect_at:
+        return False
+    with log_sock_lock:
+        if log_sock is None:
+            if time.monotonic() < log_reconnect_at:
+                return False
+            log_reconnect_at = time.monotonic() + LOG_RECONNECT_INTERVAL
+            if not connect_log_socket():
+                return False
+            print(f"[Proxy] Log Server reconnected: {LOG_SOCKET}")
+    return send_log(data)
+
+@lru_cache(maxsize=4096)
+def _domain_of(url):
+    """Extract domain from URL (cached: the same URLs repeat constantly)"""
+    return urlparse(url).netloc or 'unknown'
+
 def log_access(client_ip, method, url, status, worker, cached, response_time):
     """
     Log access for MapReduce analysis
     Format: timestamp|client_ip|method|url|domain|status|worker|cached|response_time_ms
+    (LOG_FORMAT=binary: a packed entry, see logger_server.RECORD)
     """
     try:
-        # Extract domain from URL
-        from urllib.parse import urlparse
-        parsed = urlparse(url)
-        domain = parsed.netloc or 'unknown'
-        
-        timestamp = datetime.datetime.now().isoformat()
+        domain = _domain_of(url)
         
-        log_line = f"{timestamp}|{client_ip}|{method}|{url}|{domain}|{status}|{worker}|{cached}|{response_time:.2f}\n"
+        if LOG_FORMAT == 'binary':
+            data = pack_entry(time.time(), client_ip, status, domain, worker, cached, response_time)
+        else:
+            timestamp = datetime.datetime.now().isoformat()
+            
+            log_line = f"{timestamp}|{client_ip}|{method}|{url}|{domain}|{status}|{worker}|{cached}|{response_time:.2f}\n"
+            
+            data = log_line.encode()
         
-        with log_lock:
-            with open(LOG_FILE, 'a') as f:
-                f.write(log_line)
+        # Hand off to the log server; write in-process if it is unreachable or busy
+        if not send_log(data):
+            log_queue.put(data)
                 
     except Exception as e:
         print(f"[Proxy] Log error: {e}")
@@ -98,7 +288,6 @@ class ProxyHandler(BaseHTTPRequestHandler):
     """HTTP Request Handler - forwards requests via RPC"""
     
     def do_GET(self):
-        import time
         start_time = time.time()
         
         # Build target URL
@@ -119,33 +308,27 @@ class ProxyHandler(BaseHTTPRequestHandler):
             return
         
         try:
-            # Make RPC call to worker
-            proxy = xmlrpc.client.ServerProxy(worker_url)
-            result = proxy.fetch_url(url)
+            # Fetch via worker (raw bytes, no XML-RPC encoding of the body)
+            with load_balancer.track(worker_url):
+                result = fetch_via_worker(worker_url, url)
             
             response_time = (time.time() - start_time) * 1000  # ms
             
-            # Send response
-            self.send_response(result['status'])
-            
-            # Forward headers
-            for key, value in result.get('headers', {}).items():
-                if key.lower() not in ['transfer-encoding', 'connection']:
-                    self.send_header(key, value)
-            
-            # Add proxy headers
-            self.send_header('X-Proxy', 'RPC-Proxy')
-            self.send_header('X-Worker', result.get('worker', worker_url))
-            self.send_header('X-Cached', str(result.get('cached', False)))
-            self.send_header('X-Response-Time', f"{response_time:.2f}ms")
-            self.end_headers()
+            # Send response: status line, forwarded header block and proxy
+            # headers go out as one preamble, bypassing per-header send_header()
+            status = result['status']
+            reason = self.responses.get(status, ('',))[0]
+            proxy_headers = (
+                f"X-Proxy: RPC-Proxy\r\n"
+                f"X-Worker: {result.get('worker', worker_url)}\r\n"
+                f"X-Cached: {result.get('cached', False)}\r\n"
+                f"X-Response-Time: {response_time:.2f}ms\r\n\r\n"
+            )
+            self.wfile.write(f"{self.protocol_version} {status} {reason}\r\n".encode('latin-1')
+                             + result['header_block'] + proxy_headers.encode('latin-1'))
             
             # Send content
-            content = result['content']
-            if hasattr(content, 'data'):
-                self.wfile.write(content.data)
-            else:
-                self.wfile.write(content)
+            self.wfile.write(result['content'])
             
             # Log for MapReduce
             log_access(
@@ -175,12 +358,17 @@ class ProxyHandler(BaseHTTPRequestHandler):
         pass  # Suppress default logging (we have our own)
 
 class ThreadedHTTPServer(HTTPServer):
-    """Handle requests in threads for scalability"""
+    """Handle requests on a bounded thread pool for scalability"""
+    def __init__(self, *args, max_threads=PROXY_THREADS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='proxy')
+    
     def process_request(self, request, client_address):
-        thread = threading.Thread(target=self.process_request_thread, 
-                                  args=(request, client_address))
-        thread.daemon = True
-        thread.start()
+        self.pool.submit(self.process_request_thread, request, client_address)
+    
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
     
     def process_request_thread(self, request, client_address):
         try:
@@ -192,7 +380,6 @@ class ThreadedHTTPServer(HTTPServer):
 
 def worker_health_monitor():
     """Background thread to monitor worker health"""
-    import time
     while True:
         check_workers()
         time.sleep(10)
@@ -203,7 +390,7 @@ if __name__ == "__main__":
     # For local testing
     if not os.path.exists(LOG_DIR):
         LOG_DIR = './logs'
-        LOG_FILE = os.path.join(LOG_DIR, 'access.log')
+        LOG_FILE = os.path.join(LOG_DIR, LOG_FILE_NAMES[LOG_FORMAT])
         os.makedirs(LOG_DIR, exist_ok=True)
     
     print("=" * 60)
@@ -211,6 +398,7 @@ if __name__ == "__main__":
     print("=" * 60)
     print(f"[Proxy] Starting on port {port}")
     print(f"[Proxy] Workers: {WORKERS}")
+    print(f"[Proxy] Load Balancing: {LB_POLICY}")
     print(f"[Proxy] Log File: {LOG_FILE}")
     
     # Initial worker check
@@ -221,6 +409,14 @@ if __name__ == "__main__":
         print("[Proxy] WARNING: No workers available!")
         print("[Proxy] Start workers with: python rpc_worker.py 8001")
     
+    # Access log: log server socket, with an in-process writer as fallback
+    if connect_log_socket():
+        print(f"[Proxy] Log Server: {LOG_SOCKET}")
+    else:
+        print(f"[Proxy] Log Server not reachable at {LOG_SOCKET}, writing log in-process")
+    log_writer = threading.Thread(target=append_only_writer, args=(log_queue, LOG_FILE), daemon=True)
+    log_writer.start()
+    
     # Start health monitor thread
     monitor = threading.Thread(target=worker_health_monitor, daemon=True)
     monitor.start()
@@ -235,3 +431,5 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("\n[Proxy] Shutting down...")
         server.shutdown()
+        log_queue.put(None)
+        log_writer.join(timeout=1)
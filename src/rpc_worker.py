@@ -7,10 +7,14 @@ Scalable: Can run multiple workers on different ports
 Consistent: Shared cache directory accessible by all workers
 """
 
-from xmlrpc.server import SimpleXMLRPCServer
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from socketserver import ThreadingMixIn
+from concurrent.futures import Future
+from collections import OrderedDict, deque
+from urllib.parse import urljoin, urlsplit, urlunsplit
 from xmlrpc.client import Binary
-import urllib.request
 import urllib.error
+import http.client
 import hashlib
 import threading
 import json
@@ -21,66 +25,339 @@ import os
 CACHE_DIR = os.environ.get('CACHE_DIR', './cache_data')
 CACHE_TTL = 60  # seconds
 
+# In-process cache in front of the DFS cache (hot entries skip the disk)
+MEM_CACHE_SIZE = 1024           # entries
+MEM_CACHE_MAX_BODY = 1 << 20    # larger bodies are always served from disk
+
 # Ensure cache directory exists
 os.makedirs(CACHE_DIR, exist_ok=True)
 
-cache_lock = threading.Lock()
+class MemoryCache:
+    """
+    LRU of decoded cache entries with the same TTL as the DFS cache
+    Entries are shared between threads: callers must not modify them.
+    """
+    def __init__(self, maxsize=MEM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            if entry['expires'] <= time.time():
+                del self.entries[url]
+                return None
+            self.entries.move_to_end(url)
+            return entry
+    
+    def put(self, url, status, headers, header_block, content, expires):
+        if len(content) > MEM_CACHE_MAX_BODY:
+            return
+        entry = {'status': status, 'headers': headers, 'header_block': header_block,
+                 'content': content, 'expires': expires}
+        with self.lock:
+            self.entries[url] = entry
+            self.entries.move_to_end(url)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+memory_cache = MemoryCache()
+
+# Upstream fetches in progress, so concurrent misses for one URL share a fetch
+inflight = {}
+inflight_lock = threading.Lock()
+
+# Upstream connections are kept alive per origin and reused across fetches
+ORIGIN_TIMEOUT = 10         # seconds (connect and read)
+ORIGIN_IDLE_TIMEOUT = 30    # idle connections older than this are closed, not reused
+ORIGIN_MAX_IDLE = 32        # idle connections kept per origin
+MAX_REDIRECTS = 10
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+class OriginPool:
+    """
+    Idle keep-alive connections to origin servers, per (scheme, host:port)
+    Each fetch checks out its own connection, so concurrent fetches to one
+    origin run in parallel, and later ones skip the TCP/TLS handshake.
+    """
+    def __init__(self):
+        self.idle = {}
+    
+    def get(self, url, headers):
+        """GET url (redirects are not followed); returns (response, body)"""
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"unsupported URL scheme: {parts.scheme!r}")
+        origin = (parts.scheme, parts.netloc)
+        target = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        idle = self.idle.setdefault(origin, deque())
+        
+        conn = self.checkout(idle)
+        if conn is not None:
+            try:
+                return self.send(idle, conn, target, headers)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                pass  # closed by the origin while idle: retry on a new connection
+        return self.send(idle, self.connect(origin), target, headers)
+    
+    def checkout(self, idle):
+        """Most recently used idle connection, closing any that idled too long"""
+        deadline = time.monotonic() - ORIGIN_IDLE_TIMEOUT
+        while True:
+            try:
+                since, conn = idle.pop()
+            except IndexError:
+                return None
+            if since >= deadline:
+                return conn
+            conn.close()
+    
+    def connect(self, origin):
+        scheme, netloc = origin
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=ORIGIN_TIMEOUT)
+        return http.client.HTTPConnection(netloc, timeout=ORIGIN_TIMEOUT)
+    
+    def send(self, idle, conn, target, headers):
+        try:
+            conn.request('GET', target, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except Exception:
+            conn.close()  # connection state unknown, don't reuse it
+            raise
+        if response.will_close or len(idle) >= ORIGIN_MAX_IDLE:
+            conn.close()
+        else:
+            idle.append((time.monotonic(), conn))
+        return response, body
+
+origin_pool = OriginPool()
+
+# Raw fetch endpoint: body is the URL, response body is the page as raw bytes
+FETCH_PATH = '/fetch'
+
+# Not forwarded to the client (the proxy manages its own connection)
+HOP_BY_HOP_HEADERS = ('transfer-encoding', 'connection')
+
+def serialize_headers(headers):
+    """Pre-serialize forwarded response headers as a ready-to-send HTTP header block"""
+    return ''.join(f"{key}: {value}\r\n" for key, value in headers.items()
+                   if key.lower() not in HOP_BY_HOP_HEADERS).encode('latin-1', 'replace')
+
+def header_block_of(data):
+    """Header block stored with a cache entry (serialized now for older entries)"""
+    if 'header_block' in data:
+        return data['header_block'].encode('latin-1')
+    return serialize_headers(data['headers'])
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    Keep the proxy's connection open between RPC calls (HTTP/1.1)
+    Also serves POST /fetch, which returns the page's pre-serialized
+    header block (X-Header-Length bytes) followed by the content as raw
+    bytes (no base64/XML), with status etc. as JSON in X-Fetch-Meta.
+    """
+    protocol_version = 'HTTP/1.1'
+    timeout = 60  # close idle keep-alive connections
+    
+    def log_error(self, format, *args):
+        # An idle keep-alive connection reaching `timeout` is routine, not an error
+        if format.startswith('Request timed out'):
+            return
+        super().log_error(format, *args)
+    
+    def do_POST(self):
+        if self.path != FETCH_PATH:
+            return super().do_POST()
+        
+        length = int(self.headers.get('Content-Length', 0))
+        url = self.rfile.read(length).decode()
+        worker_id = os.environ.get('WORKER_ID', 'local')
+        
+        # Cache hit in memory: no disk access at all
+        entry = memory_cache.get(url)
+        if entry is not None:
+            print(f"[Worker {worker_id}] Cache HIT (memory): {url}")
+            self.send_fetch_headers(self.cached_meta(entry, worker_id), entry['header_block'],
+                                    len(entry['content']))
+            self.wfile.write(entry['content'])
+            return
+        
+        # Cache hit on DFS: small bodies are kept in memory for next time,
+        # large ones are sent straight from the file to the socket (sendfile)
+        entry = lookup_cache(url)
+        if entry is not None:
+            data, body_path = entry
+            try:
+                f = open(body_path, 'rb')
+            except OSError:
+                f = None
+            if f is not None:
+                with f:
+                    size = os.fstat(f.fileno()).st_size
+                    # A body of another size was written by a newer fetch after the metadata
+                    # was read: its header block (Content-Length) won't match, so it's a miss
+                    if body_matches(data, size):
+                        print(f"[Worker {worker_id}] Cache HIT (DFS): {url}")
+                        header_block = header_block_of(data)
+                        self.send_fetch_headers(self.cached_meta(data, worker_id), header_block, size)
+                        if size <= MEM_CACHE_MAX_BODY:
+                            content = f.read()
+                            memory_cache.put(url, data['status'], data['headers'], header_block,
+                                             content, data['expires'])
+                            self.wfile.write(content)
+                        else:
+                            self.wfile.flush()  # headers are buffered; send them before the body
+                            self.connection.sendfile(f)
+                        return
+        
+        result = fetch_from_origin(url)
+        content = result.pop('content').data
+        header_block = serialize_headers(result.pop('headers'))
+        self.send_fetch_headers(result, header_block, len(content))
+        self.wfile.write(content)
+    
+    def cached_meta(self, entry, worker_id):
+        return {'status': entry['status'], 'cached': True, 'worker': worker_id}
+    
+    def send_fetch_headers(self, meta, header_block, content_length):
+        """Send response headers and the page's header block; caller sends the content"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('X-Fetch-Meta', json.dumps(meta))
+        self.send_header('X-Header-Length', str(len(header_block)))
+        self.send_header('Content-Length', str(len(header_block) + content_length))
+        self.end_headers()
+        self.wfile.write(header_block)
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """One thread per proxy connection, so kept-alive connections don't block each other"""
+    daemon_threads = True
 
 def get_cache_key(url):
-    """Generate cache filename from URL hash"""
-    return hashlib.md5(url.encode()).hexdigest()
+    """Generate cache filename from URL hash (BLAKE2b: the fastest stdlib hash per call on short URLs)"""
+    return hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
 
 def get_cache_path(cache_key):
-    """Get full path to cache file"""
+    """Get full path to cache metadata file (status, headers)"""
     return os.path.join(CACHE_DIR, f"{cache_key}.json")
 
-def read_from_cache(url):
+def get_body_path(cache_key):
+    """Get full path to cache body file (raw content bytes)"""
+    return os.path.join(CACHE_DIR, f"{cache_key}.bin")
+
+def body_matches(data, size):
+    """Whether a body file of this size belongs to the metadata in data"""
+    return data.get('content_length', size) == size
+
+def lookup_cache(url):
     """
-    [DFS] Read cache from shared file system
-    All workers can access this cache
+    [DFS] Find a fresh cache entry on the shared file system
+    Returns (metadata dict, body file path) or None
     """
     cache_key = get_cache_key(url)
     cache_path = get_cache_path(cache_key)
+    body_path = get_body_path(cache_key)
     
     try:
         if os.path.exists(cache_path):
             # Check TTL
-            file_age = time.time() - os.path.getmtime(cache_path)
-            if file_age < CACHE_TTL:
+            expires = os.path.getmtime(cache_path) + CACHE_TTL
+            if time.time() < expires:
                 with open(cache_path, 'r') as f:
                     data = json.load(f)
-                # Convert content back to Binary
-                data['content'] = Binary(bytes.fromhex(data['content_hex']))
-                return data
+                data['expires'] = expires
+                return data, body_path
             else:
-                # Cache expired, remove file
+                # Cache expired, remove files
                 os.remove(cache_path)
+                os.remove(body_path)
     except Exception as e:
         print(f"[Worker] Cache read error: {e}")
     
     return None
 
+def read_from_cache(url):
+    """
+    [DFS] Read cache from shared file system
+    All workers can access this cache
+    Checks this worker's memory cache first.
+    """
+    entry = memory_cache.get(url)
+    if entry is not None:
+        return {'status': entry['status'], 'headers': entry['headers'],
+                'content': Binary(entry['content'])}
+    
+    entry = lookup_cache(url)
+    if entry is None:
+        return None
+    
+    data, body_path = entry
+    try:
+        with open(body_path, 'rb') as f:
+            content = f.read()
+        if not body_matches(data, len(content)):
+            return None  # replaced by a newer fetch since the metadata was read
+        memory_cache.put(url, data['status'], data['headers'], header_block_of(data),
+                         content, data['expires'])
+        data['content'] = Binary(content)
+        return data
+    except Exception as e:
+        print(f"[Worker] Cache read error: {e}")
+    
+    return None
+
+def write_file_atomic(path, payload):
+    """
+    Write a file so readers only ever see the old or the complete new
+    version: write a private temp file, then rename it over the target
+    """
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 def write_to_cache(url, data):
     """
     [DFS] Write cache to shared file system
     Other workers can read this cache
+    Body is stored as raw bytes; metadata is written last so an entry
+    is only visible once its body is complete. The metadata records the
+    body's length, so readers can tell if the body was replaced since.
     """
     cache_key = get_cache_key(url)
     cache_path = get_cache_path(cache_key)
     
     try:
-        # Convert Binary content to hex string for JSON
+        header_block = serialize_headers(data['headers'])
         cache_data = {
             'url': url,
             'status': data['status'],
             'headers': data['headers'],
-            'content_hex': data['content'].data.hex(),
+            'header_block': header_block.decode('latin-1'),
+            'content_length': len(data['content'].data),
             'timestamp': time.time()
         }
         
-        with cache_lock:
-            with open(cache_path, 'w') as f:
-                json.dump(cache_data, f)
+        # No lock needed: each file is replaced atomically, so concurrent
+        # writers (threads or other workers) never expose a partial file
+        write_file_atomic(get_body_path(cache_key), data['content'].data)
+        write_file_atomic(cache_path, json.dumps(cache_data).encode())
+        memory_cache.put(url, data['status'], data['headers'], header_block,
+                         data['content'].data, cache_data['timestamp'] + CACHE_TTL)
         
         print(f"[Worker] Cached to DFS: {cache_key[:8]}...")
     except Exception as e:
@@ -105,31 +382,64 @@ def fetch_url(url):
             'worker': worker_id
         }
     
-    # Fetch from internet
+    return fetch_from_origin(url)
+
+def fetch_from_origin(url):
+    """
+    Fetch URL from the internet and write it to the shared cache
+    Concurrent requests for a URL already being fetched wait for that
+    fetch instead of starting their own.
+    """
+    with inflight_lock:
+        future = inflight.get(url)
+        leader = future is None
+        if leader:
+            future = inflight[url] = Future()
+    
+    if leader:
+        try:
+            future.set_result(_fetch_from_origin(url))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with inflight_lock:
+                del inflight[url]
+    else:
+        print(f"[Worker {os.environ.get('WORKER_ID', 'local')}] Joined in-flight fetch: {url}")
+    
+    return dict(future.result())  # callers may modify their copy
+
+def _fetch_from_origin(url):
+    worker_id = os.environ.get('WORKER_ID', 'local')
+    
     print(f"[Worker {worker_id}] Fetching: {url}")
     try:
-        req = urllib.request.Request(url, headers={
-            'User-Agent': 'Mozilla/5.0 (RPC Proxy Worker)'
-        })
+        # Pooled upstream connection; redirects and HTTP errors as urlopen() does
+        target = url
+        for _ in range(MAX_REDIRECTS + 1):
+            response, content = origin_pool.get(target, {
+                'User-Agent': 'Mozilla/5.0 (RPC Proxy Worker)'
+            })
+            location = response.getheader('Location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                break
+            target = urljoin(target, location)
+        if response.status >= 400:
+            raise urllib.error.HTTPError(target, response.status, response.reason, response.headers, None)
+        
+        result = {
+            'status': response.status,
+            'headers': dict(response.headers),
+            'content': Binary(content),
+            'cached': False,
+            'worker': worker_id
+        }
+        
+        # Write to shared cache (DFS)
+        write_to_cache(url, result)
+        
+        return result
         
-        with urllib.request.urlopen(req, timeout=10) as response:
-            content = response.read()
-            status = response.status
-            headers = dict(response.headers)
-            
-            result = {
-                'status': status,
-                'headers': headers,
-                'content': Binary(content),
-                'cached': False,
-                'worker': worker_id
-            }
-            
-            # Write to shared cache (DFS)
-            write_to_cache(url, result)
-            
-            return result
-            
     except urllib.error.HTTPError as e:
         return {
             'status': e.code,
@@ -167,12 +477,33 @@ def health_check():
 
 def clear_cache():
     """Clear shared cache (DFS)"""
-    with cache_lock:
-        for f in os.listdir(CACHE_DIR):
-            if f.endswith('.json'):
-                os.remove(os.path.join(CACHE_DIR, f))
+    memory_cache.clear()
+    for f in os.listdir(CACHE_DIR):
+        if f.endswith(('.json', '.bin')):
+            os.remove(os.path.join(CACHE_DIR, f))
     return True
 
+def sweep_cache():
+    """
+    Remove cache files older than CACHE_TTL (run at startup)
+    lookup_cache() only removes an expired entry when its URL is requested
+    again, so entries nobody asks for again (e.g. ones keyed by an older
+    hash) would otherwise stay forever and count as cache entries.
+    """
+    cutoff = time.time() - CACHE_TTL
+    removed = 0
+    for name in os.listdir(CACHE_DIR):
+        if not (name.endswith(('.json', '.bin')) or '.tmp.' in name):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass  # removed by another worker meanwhile
+    return removed
+
 def get_stats():
     """Get worker statistics"""
     cache_files = [f for f in os.listdir(CACHE_DIR) if f.endswith('.json')]
@@ -194,7 +525,11 @@ if __name__ == "__main__":
         CACHE_DIR = './cache_data'
         os.makedirs(CACHE_DIR, exist_ok=True)
     
-    server = SimpleXMLRPCServer(("0.0.0.0", port), allow_none=True)
+    removed = sweep_cache()
+    if removed:
+        print(f"[RPC Worker {worker_id}] Removed {removed} expired cache files")
+    
+    server = ThreadedXMLRPCServer(("0.0.0.0", port), requestHandler=KeepAliveRequestHandler, allow_none=True)
     
     server.register_function(fetch_url, "fetch_url")
     server.register_function(health_check, "health_check")
@@ -204,6 +539,7 @@ if __name__ == "__main__":
     print(f"[RPC Worker {worker_id}] Running on port {port}")
     print(f"[RPC Worker {worker_id}] Cache Dir (DFS): {CACHE_DIR}")
     print("[RPC Worker] Functions: fetch_url, health_check, clear_cache, get_stats")
+    print(f"[RPC Worker] Raw fetch: POST {FETCH_PATH}")
     
     try:
         server.serve_forever()
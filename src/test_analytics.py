@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests for the analytics mappers
+Run: python test_analytics.py (or pytest)
+"""
+
+import os
+import tempfile
+
+from analytics import binary_mapper, mapper, run_mapreduce
+from logger_server import RecordEncoder, pack_entry
+
+BAD_RESPONSE_TIMES = ('-5', '-1', 'nan', 'inf')
+
+def log_line(response_time):
+    return f"2026-01-01T10:00:00|127.0.0.1|GET|http://a.com/|a.com|200|w1|True|{response_time}"
+
+def test_mapper_drops_bad_response_times():
+    """Negative, NaN and inf response times are skipped, not fatal"""
+    partial = mapper([log_line(rt) for rt in ('1.50',) + BAD_RESPONSE_TIMES + ('2.50',)])
+    assert partial['rt_n'] == 2
+    assert partial['rt_sum'] == 4.0
+    assert partial['domain'] == {'a.com': 2}
+    assert sum(partial['rt_hist'].values()) == 2
+
+def test_binary_mapper_drops_bad_response_times():
+    with tempfile.TemporaryDirectory() as tmp:
+        encode = RecordEncoder(os.path.join(tmp, 'access.bin'))
+        def records(response_times):
+            return b''.join(encode(pack_entry(0, '127.0.0.1', 200, 'a.com', 'w1', True, float(rt)))
+                            for rt in response_times)
+        mixed = records(('1.5',) + BAD_RESPONSE_TIMES + ('2.5',))
+        only_bad = records(BAD_RESPONSE_TIMES)
+        encode.close()
+
+        partial = binary_mapper(mixed, ['a.com', 'w1'])
+        assert partial['rt_n'] == 2
+        assert partial['rt_sum'] == 4.0
+        assert partial['domain'] == {'a.com': 2}
+        assert binary_mapper(only_bad, ['a.com', 'w1'])['rt_n'] == 0
+
+def test_run_survives_bad_response_times():
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, 'access.log')
+        with open(log_file, 'w') as f:
+            f.writelines(log_line(rt) + '\n' for rt in BAD_RESPONSE_TIMES + ('3.00',))
+        results = run_mapreduce(log_file, incremental=False)
+        assert results['rt_n'] == 1
+        assert results['rt_percentiles'][50] > 0
+
+if __name__ == "__main__":
+    for test in (test_mapper_drops_bad_response_times,
+                 test_binary_mapper_drops_bad_response_times,
+                 test_run_survives_bad_response_times):
+        test()
+        print(f"[Test] {test.__name__}: OK")
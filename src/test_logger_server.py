@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests for the binary access log encoding
+Run: python test_logger_server.py (or pytest)
+"""
+
+import os
+import tempfile
+
+from logger_server import RECORD, RecordEncoder, load_strings, pack_entry, strings_file_of
+
+def decode(log_file, records):
+    """(domain, worker) names of each record, via the side table"""
+    names = load_strings(strings_file_of(log_file))
+    return [(names[domain], names[worker])
+            for _, _, _, domain, worker, _, _ in RECORD.iter_unpack(records)]
+
+def test_two_encoders_share_strings():
+    """Log server and in-process fallback interning into the same table"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, 'access.bin')
+        logger = RecordEncoder(log_file)
+        fallback = RecordEncoder(log_file)
+
+        records = b''.join([
+            logger(pack_entry(0, '127.0.0.1', 200, 'a.com', 'w1', True, 1.0)),
+            fallback(pack_entry(0, '127.0.0.1', 200, 'b.com', 'w2', False, 2.0)),
+            logger(pack_entry(0, '127.0.0.1', 200, 'b.com', 'w1', False, 3.0)),
+            fallback(pack_entry(0, '127.0.0.1', 200, 'a.com', 'w2', True, 4.0)),
+        ])
+        logger.close()
+        fallback.close()
+
+        assert decode(log_file, records) == [('a.com', 'w1'), ('b.com', 'w2'),
+                                             ('b.com', 'w1'), ('a.com', 'w2')]
+        assert load_strings(strings_file_of(log_file)) == ['a.com', 'w1', 'b.com', 'w2']
+
+def test_encoder_reloads_table():
+    """A restarted writer keeps the ids already in the table"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, 'access.bin')
+        first = RecordEncoder(log_file)
+        records = first(pack_entry(0, '127.0.0.1', 200, 'a.com', 'w1', True, 1.0))
+        first.close()
+
+        second = RecordEncoder(log_file)
+        records += second(pack_entry(0, '127.0.0.1', 200, 'a.com', 'w1', True, 1.0))
+        second.close()
+
+        assert decode(log_file, records) == [('a.com', 'w1'), ('a.com', 'w1')]
+        assert load_strings(strings_file_of(log_file)) == ['a.com', 'w1']
+
+if __name__ == "__main__":
+    for test in (test_two_encoders_share_strings, test_encoder_reloads_table):
+        test()
+        print(f"[Test] {test.__name__}: OK")